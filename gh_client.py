@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Pooled GitHub API client shared by invite_to_org.py and manage_groups.py.
+
+The token is read once from `gh auth token`; requests reuse keep-alive HTTPS
+connections instead of spawning a `gh` process per call. GET responses are
+revalidated with ETags across runs, so unchanged resources come back as 304s
+that do not count against the rate limit. Requests are paced from the
+X-RateLimit-* headers and retried with backoff when GitHub throttles anyway.
+"""
+import asyncio, json, random, re, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPSConnection, HTTPException, RemoteDisconnected
+from pathlib import Path
+from queue import LifoQueue, Empty, Full
+
+API_HOST = "api.github.com"
+CACHE_DIR = Path.home() / ".cache" / "organization-automation"
+ETAG_CACHE = CACHE_DIR / "etag_cache.json"
+PACE_BELOW = 50   # start spreading requests once this few remain in the window
+MAX_RETRIES = 5
+_NEXT_LINK = re.compile(r'<https://api\.github\.com([^>]+)>;\s*rel="next"')
+
+class GhError(RuntimeError):
+    pass
+
+def gh_token() -> str:
+    cp = subprocess.run(["gh","auth","token"], text=True, capture_output=True)
+    if cp.returncode != 0 or not cp.stdout.strip():
+        print("Not authed; run `gh auth login`"); sys.exit(1)
+    return cp.stdout.strip()
+
+class Response:
+    def __init__(self, status: int, headers, body: bytes):
+        self.status, self.headers, self.body = status, headers, body
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", "replace").strip()
+
+class GhClient:
+    def __init__(self, token: str | None = None, max_connections: int = 20, etag_cache: Path | None = ETAG_CACHE):
+        self.headers = {
+            "Authorization": f"Bearer {token or gh_token()}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            "User-Agent": "organization-automation",
+        }
+        self._pool = LifoQueue(maxsize=max_connections)
+        # one worker per pooled connection; asyncio's default executor can be smaller than that
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="gh")
+        self._etag_path, self._etags, self._etags_dirty = etag_cache, {}, False
+        self._etag_lock = threading.Lock()
+        self.limits: dict[str, tuple[int, int]] = {}  # resource -> (remaining, reset epoch)
+        self._next_send: dict[str, float] = {}  # resource -> earliest time the next paced request may go out
+        self._pace_lock = asyncio.Lock()
+        if etag_cache and etag_cache.exists():
+            try: self._etags = json.loads(etag_cache.read_text(encoding="utf-8"))
+            except (OSError, ValueError): self._etags = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        while True:
+            try: self._pool.get_nowait().close()
+            except Empty: break
+        self._executor.shutdown()
+        if self._etag_path and self._etags_dirty:
+            self._etag_path.parent.mkdir(parents=True, exist_ok=True)
+            self._etag_path.write_text(json.dumps(self._etags), encoding="utf-8")
+            self._etags_dirty = False
+
+    def _invalidate(self, path: str):
+        """Drop cached GETs of a resource (and anything below it) after writing to it."""
+        base = "GET " + path.split("?", 1)[0]
+        with self._etag_lock:
+            for k in [k for k in self._etags if k == base or k.startswith((base + "?", base + "/"))]:
+                del self._etags[k]; self._etags_dirty = True
+
+    def _send(self, method: str, path: str, body) -> Response:
+        payload = None if body is None else json.dumps(body).encode()
+        headers = dict(self.headers, **({"Content-Type": "application/json"} if payload else {}))
+        key = f"{method} {path}"
+        cached = self._etags.get(key) if method == "GET" else None
+        if cached and "link" not in cached: cached = None  # entry from before Link was cached
+        if cached: headers["If-None-Match"] = cached["etag"]
+        r, data = self._roundtrip(method, path, payload, headers)
+        if cached and r.status == 304:
+            # the 304 may omit Link; replay the cached page's pagination header
+            del r.headers["Link"]
+            if cached.get("link"): r.headers["Link"] = cached["link"]
+            return Response(200, r.headers, cached["body"].encode())
+        if method == "GET":
+            etag = r.headers.get("ETag")
+            if r.status == 200 and etag:
+                with self._etag_lock:
+                    self._etags[key] = {"etag": etag, "body": data.decode("utf-8", "replace"),
+                                        "link": r.headers.get("Link")}
+                    self._etags_dirty = True
+        elif 200 <= r.status < 300:
+            self._invalidate(path)
+        return Response(r.status, r.headers, data)
+
+    def _roundtrip(self, method: str, path: str, payload: bytes | None, headers: dict):
+        while True:
+            try: conn, reused = self._pool.get_nowait(), True
+            except Empty: conn, reused = HTTPSConnection(API_HOST, timeout=30), False
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                r = conn.getresponse(); data = r.read()
+            except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if reused: continue  # idle keep-alive connection was dropped by the server
+                raise
+            except (HTTPException, OSError):
+                conn.close()  # e.g. a timeout after the request went out; resending could duplicate a POST
+                raise
+            if r.will_close: conn.close()
+            else:
+                try: self._pool.put_nowait(conn)
+                except Full: conn.close()
+            return r, data
+
+    async def request(self, method: str, path: str, body=None) -> Response:
+        resource = "graphql" if path == "/graphql" else "core"
+        for attempt in range(MAX_RETRIES + 1):
+            await self._pace(resource)
+            r = await asyncio.get_running_loop().run_in_executor(self._executor, self._send, method, path, body)
+            self._track(r)
+            if attempt == MAX_RETRIES or not self._throttled(r): return r
+            retry_after = r.headers.get("Retry-After")
+            await asyncio.sleep(int(retry_after) if retry_after and retry_after.isdigit()
+                                else min(60, 2 ** attempt + random.random()))
+
+    def _track(self, r: Response):
+        remaining, reset = r.headers.get("X-RateLimit-Remaining"), r.headers.get("X-RateLimit-Reset")
+        if remaining is not None and reset is not None:
+            self.limits[r.headers.get("X-RateLimit-Resource") or "core"] = (int(remaining), int(reset))
+
+    @staticmethod
+    def _throttled(r: Response) -> bool:
+        return r.status == 429 or (r.status == 403 and (r.headers.get("X-RateLimit-Remaining") == "0"
+                                                          or r.headers.get("Retry-After") is not None))
+
+    async def _pace(self, resource: str):
+        """Spread the rest of the window's budget instead of running into a 403.
+
+        Each caller reserves one request of budget and a send slot under the lock,
+        so concurrent requests are staggered rather than all waking at once.
+        """
+        async with self._pace_lock:
+            if resource not in self.limits: return
+            remaining, reset = self.limits[resource]
+            now = time.time()
+            if remaining >= PACE_BELOW or reset <= now: return
+            slot = max(now, self._next_send.get(resource, now))
+            self._next_send[resource] = slot + (reset - now) / max(remaining, 1)
+            self.limits[resource] = (max(remaining - 1, 0), reset)
+        if slot > now: await asyncio.sleep(slot - now)
+
+    async def get(self, path: str) -> Response:
+        return await self.request("GET", path)
+
+    async def post(self, path: str, body) -> Response:
+        return await self.request("POST", path, body)
+
+    async def put(self, path: str, body) -> Response:
+        return await self.request("PUT", path, body)
+
+    async def paginate(self, path: str):
+        """Yield items from a list endpoint, following `Link: rel="next"` headers."""
+        while path:
+            r = await self.get(path)
+            if not r.ok: raise GhError(f"GET {path} failed ({r.status}): {r.text()}")
+            for item in r.json() or []: yield item
+            m = _NEXT_LINK.search(r.headers.get("Link") or "")
+            path = m.group(1) if m else None
+
+    async def graphql(self, query: str, partial: bool = False, **variables) -> dict:
+        """Run a query; with partial=True, field-level errors (e.g. unknown logins) come back as nulls."""
+        r = await self.post("/graphql", {"query": query, "variables": variables})
+        data = r.json() or {}
+        if not r.ok or data.get("data") is None or (data.get("errors") and not partial):
+            raise GhError(f"GraphQL request failed ({r.status}): {data.get('errors') or r.text()}")
+        return data["data"]
+
+async def fetch_org_members(gh: GhClient, org: str) -> frozenset[str]:
+    """Lowercased logins of every org member (REST, so reruns revalidate via the ETag cache)."""
+    return frozenset([m["login"].lower() async for m in gh.paginate(f"/orgs/{org}/members?per_page=100")])
@@ -1,61 +1,145 @@
 #!/usr/bin/env python3
-import argparse, json, re, subprocess, sys
+import argparse, asyncio, json, logging, re, sqlite3, subprocess, sys, time
+from http.client import HTTPException
 from pathlib import Path
 
-def run(cmd, *, input_text=None, check=True, desc=None):
-    if desc: print(f"→ {desc}: {' '.join(cmd)}")
-    cp = subprocess.run(cmd, text=True, input=input_text, capture_output=True)
-    if cp.stdout.strip(): print(cp.stdout.strip())
-    if cp.stderr.strip(): print("(stderr)", cp.stderr.strip())
-    if check and cp.returncode != 0: sys.exit(cp.returncode)
+from gh_client import CACHE_DIR, GhClient, GhError, fetch_org_members
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+# 422s that mean the invite is already in place; others (e.g. "Over invitation rate limit") are failures
+_ALREADY_INVITED = re.compile(r"already (?:a part of|a member|been invited|invited)", re.I)
+log = logging.getLogger("invite_to_org")
+UID_CACHE = CACHE_DIR / "uids.sqlite"
+UID_TTL = 30 * 24 * 3600  # login -> id practically never changes; refresh monthly anyway
+
+def run(cmd, *, check=True, desc=None):
+    if desc: log.debug("→ %s: %s", desc, cmd)
+    # stdout is only ever shown at debug level; stderr is kept for failure reports
+    verbose = log.isEnabledFor(logging.DEBUG)
+    cp = subprocess.run(cmd, stdout=subprocess.PIPE if verbose else subprocess.DEVNULL, stderr=subprocess.PIPE)
+    failed = check and cp.returncode != 0
+    if failed or verbose:
+        level = logging.ERROR if failed else logging.DEBUG
+        for label, out in (("", cp.stdout), ("(stderr) ", cp.stderr)):
+            if out and out.strip(): log.log(level, "%s%s", label, out.decode("utf-8", "replace").strip())
+    if failed: sys.exit(cp.returncode)
     return cp
 
 def load_students(path: Path):
     raw = path.read_text(encoding="utf-8")
-    cleaned = re.sub(r',\s*([}\]])', r'\1', raw)  # tolerate trailing commas
+    cleaned = _TRAILING_COMMA.sub(r'\1', raw)  # tolerate trailing commas
     data = json.loads(cleaned)
-    rows = []
+    # column layout: parallel lists, one entry per student; "keys" is the lowercased
+    # username that every lookup uses (GitHub logins are case-insensitive)
+    cols = {"names": [], "usernames": [], "keys": []}
     for it in data:
         if isinstance(it, dict) and it.get("username"):
-            rows.append({"name": (it.get("name") or "").strip(),
-                         "username": it["username"].strip().lstrip("@")})
-    if not rows:
+            u = it["username"].strip().lstrip("@")
+            cols["names"].append((it.get("name") or "").strip())
+            cols["usernames"].append(u); cols["keys"].append(u.lower())
+    if not cols["usernames"]:
         print("✖ No students found"); sys.exit(1)
-    return rows
+    return cols
 
-def gh_prechecks(org):
+def gh_prechecks():
     run(["gh","--version"], desc="check gh")
     run(["gh","auth","status"], desc="check auth")
-    run(["gh","api",f"orgs/{org}","--jq",".login"], desc=f"check org {org}")
-
-def resolve_uid(username: str) -> int | None:
-    cp = subprocess.run(["gh","api",f"users/{username}","--jq",".id"], text=True, capture_output=True)
-    if cp.returncode != 0: return None
-    try: return int(cp.stdout.strip())
-    except: return None
-
-def is_member(org: str, username: str) -> bool:
-    return subprocess.run(["gh","api","-X","GET",f"orgs/{org}/memberships/{username}"], text=True, capture_output=True).returncode == 0
-
-def has_pending(org: str, user: str) -> bool:
-    cp = subprocess.run([
-        "gh","api",f"orgs/{org}/invitations?per_page=100",
-        "--jq",f".[] | select((.login? // \"\") == \"{user}\" or (.email? // \"\") == \"{user}\") | .id"
-    ], text=True, capture_output=True)
-    return bool(cp.stdout.strip())
-
-def invite(org: str, uid: int, role: str) -> bool:
-    body = {"invitee_id": uid, "role": role}
-    cp = subprocess.run(
-        ["gh","api","--method","POST",f"orgs/{org}/invitations",
-         "-H","Content-Type: application/json","--input","-"],
-        text=True, input=json.dumps(body), capture_output=True
-    )
-    if cp.returncode == 0: print("   ✓ invited"); return True
-    print("   ✖ invite failed")
-    if cp.stdout.strip(): print(cp.stdout.strip())
-    if cp.stderr.strip(): print(cp.stderr.strip())
-    return False
+
+async def check_org(gh: GhClient, org: str):
+    log.debug("→ check org %s: GET /orgs/%s", org, org)
+    r = await gh.get(f"/orgs/{org}")
+    if not r.ok: print(f"✖ org '{org}' not accessible ({r.status})"); sys.exit(1)
+    log.debug("%s", (r.json() or {}).get("login", org))
+
+def open_uid_cache(path: Path = UID_CACHE) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS uids(username TEXT PRIMARY KEY, id INTEGER, fetched_at INTEGER)")
+    return db
+
+async def resolve_uids(gh: GhClient, logins: list[str], db: sqlite3.Connection | None = None) -> dict[str, int | None]:
+    """Resolve lowercased logins to user ids: fresh cache hits first, then one aliased GraphQL query per 100 misses."""
+    uids = dict.fromkeys(logins)
+    now = int(time.time())
+    if db:
+        for u in logins:
+            row = db.execute("SELECT id FROM uids WHERE username=? AND fetched_at>?", (u, now - UID_TTL)).fetchone()
+            if row: uids[u] = row[0]
+    names = [u for u in logins if uids[u] is None and "@" not in u]  # email invitees have no login to resolve
+    for start in range(0, len(names), 100):
+        chunk = names[start:start + 100]
+        params = ", ".join(f"$l{j}: String!" for j in range(len(chunk)))
+        fields = " ".join(f"u{j}: user(login: $l{j}) {{ databaseId }}" for j in range(len(chunk)))
+        data = await gh.graphql(f"query({params}) {{ {fields} }}", partial=True,
+                                **{f"l{j}": u for j, u in enumerate(chunk)})
+        for j, u in enumerate(chunk):
+            uids[u] = (data.get(f"u{j}") or {}).get("databaseId")
+    if db:
+        with db:
+            db.executemany("INSERT OR REPLACE INTO uids VALUES (?, ?, ?)",
+                           [(u, uids[u], now) for u in names if uids[u] is not None])
+    return uids
+
+async def fetch_pending_invitations(gh: GhClient, org: str) -> set[str]:
+    """Lowercased login (or email, for email invites) of every pending invitation."""
+    return {(inv.get("login") or inv.get("email") or "").lower()
+            async for inv in gh.paginate(f"/orgs/{org}/invitations?per_page=100")} - {""}
+
+async def fetch_org_state(gh: GhClient, org: str) -> tuple[frozenset[str], set[str]]:
+    """Return (member logins, pending invite logins/emails), lowercased."""
+    return tuple(await asyncio.gather(fetch_org_members(gh, org), fetch_pending_invitations(gh, org)))
+
+async def invite(gh: GhClient, org: str, uid: int, role: str) -> tuple[bool, str]:
+    r = await gh.post(f"/orgs/{org}/invitations", {"invitee_id": uid, "role": role})
+    if r.ok: return True, "✓ invited"
+    if r.status == 422 and _ALREADY_INVITED.search(r.text()): return True, "✓ already invited (422)"
+    return False, f"✖ invite failed\n{r.text()}".strip()
+
+async def invite_students(args, students) -> dict[str, int]:
+    counts = {"ok": 0, "skip": 0, "fail": 0}
+    sem = asyncio.Semaphore(8)
+    async with GhClient() as gh:
+        await check_org(gh, args.org)
+        try: members, pending = await fetch_org_state(gh, args.org)
+        except GhError as e: print(f"✖ cannot fetch org state: {e}"); sys.exit(1)
+        names, usernames, keys = students["names"], students["usernames"], students["keys"]
+        log.info("Inviting %d to '%s' as '%s'", len(usernames), args.org, args.role)
+
+        def report(i: int, status: str, msg: str):
+            # failures stay visible under -q
+            log.log(logging.ERROR if status == "fail" else logging.INFO,
+                    "[%d/%d] %s (%s)\n   %s", i+1, len(usernames), names[i] or usernames[i], usernames[i], msg)
+            counts[status] += 1
+
+        # everything decidable from the preloaded org state is reported up front
+        todo = []
+        for i, key in enumerate(keys):
+            if key in members: report(i, "skip", "… already member → skip")
+            elif key in pending: report(i, "skip", "… pending invite → skip")
+            elif args.dry_run: report(i, "ok", "[DRY] would invite")
+            else: todo.append(i)
+
+        uids = {}
+        if todo:  # nothing to resolve on dry runs or when everyone is handled; don't create the cache
+            db = open_uid_cache()
+            try: uids = await resolve_uids(gh, [keys[i] for i in todo], db)
+            except GhError as e: print(f"✖ cannot resolve user ids: {e}"); sys.exit(1)
+            finally: db.close()
+
+        async def process(i: int):
+            async with sem:
+                try:
+                    uid = uids[keys[i]]
+                    if uid is None: return i, False, "✖ cannot resolve user id"
+                    return (i, *await invite(gh, args.org, uid, args.role))
+                except (HTTPException, OSError) as e:
+                    return i, False, f"✖ request error: {e}"
+
+        for fut in asyncio.as_completed([process(i) for i in todo]):
+            i, ok, msg = await fut
+            report(i, "ok" if ok else "fail", msg)
+    return counts
 
 def main():
     ap = argparse.ArgumentParser(description="Invite students to a GitHub org (JSON body).")
@@ -63,26 +147,21 @@ def main():
     ap.add_argument("--file", required=True)
     ap.add_argument("--role", default="direct_member", choices=["direct_member","admin"])
     ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("-v", "--verbose", action="store_true", help="also show precheck commands and their output")
+    ap.add_argument("-q", "--quiet", action="store_true", help="only print errors and the summary")
     args = ap.parse_args()
+    log.addHandler(logging.StreamHandler(sys.stdout))
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO)
 
-    gh_prechecks(args.org)
+    gh_prechecks()
     students = load_students(Path(args.file))
-    # de-dupe by username
-    seen=set(); students=[s for s in students if not (s["username"] in seen or seen.add(s["username"]))]
-
-    print(f"Inviting {len(students)} to '{args.org}' as '{args.role}'")
-    ok=sk=fail=0
-    for i,s in enumerate(students,1):
-        name=s["name"] or s["username"]; u=s["username"]
-        print(f"[{i}/{len(students)}] {name} ({u})")
-        if "@" not in u and is_member(args.org,u): print("   … already member → skip"); sk+=1; continue
-        if has_pending(args.org,u): print("   … pending invite → skip"); sk+=1; continue
-        if args.dry_run: print("   [DRY] would invite"); ok+=1; continue
-        uid=resolve_uid(u)
-        if uid is None: print("   ✖ cannot resolve user id"); fail+=1; continue
-        if invite(args.org, uid, args.role): ok+=1
-        else: fail+=1
-    print(f"Summary: ok={ok} skip={sk} fail={fail}")
+    # de-dupe by (case-insensitive) username, keeping the first occurrence (dicts preserve insertion order)
+    first = {}
+    for i, key in enumerate(students["keys"]): first.setdefault(key, i)
+    students = {col: [vals[i] for i in first.values()] for col, vals in students.items()}
+
+    counts = asyncio.run(invite_students(args, students))
+    print(f"Summary: ok={counts['ok']} skip={counts['skip']} fail={counts['fail']}")
 
 if __name__ == "__main__":
     main()
@@ -1,69 +1,109 @@
 #!/usr/bin/env python3
-import argparse, json, re, subprocess, sys
+import argparse, asyncio, io, json, re, subprocess, sys
+from http.client import HTTPException
 from pathlib import Path
+from urllib.parse import quote
 
-def run(cmd, *, input_text=None):
-    return subprocess.run(cmd, text=True, input=input_text, capture_output=True)
+from gh_client import GhClient, GhError, fetch_org_members
 
-def gh_ok(org: str):
-    if run(["gh","auth","status"]).returncode != 0:
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_SLUG_DROP = re.compile(r"[^a-z0-9]+")
+_SLUG_RUN = re.compile(r"-+")
+
+def gh_ok():
+    if subprocess.run(["gh","auth","status"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
         print("Not authed; run `gh auth login`"); sys.exit(1)
-    if run(["gh","api", f"orgs/{org}", "--jq", ".login"]).returncode != 0:
+
+async def org_ok(gh: GhClient, org: str):
+    if not (await gh.get(f"/orgs/{org}")).ok:
         print(f"Org '{org}' not accessible"); sys.exit(1)
 
 def slugify(name: str) -> str:
     s = name.strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
-    s = re.sub(r"-+", "-", s).strip("-")
+    s = _SLUG_DROP.sub("-", s)
+    s = _SLUG_RUN.sub("-", s).strip("-")
     return s or "team"
 
-def team_exists(org: str, slug: str) -> bool:
-    return run(["gh","api", f"orgs/{org}/teams/{slug}"]).returncode == 0
-
-def create_team(org: str, name: str, privacy="closed", description="") -> str:
+async def create_team(gh: GhClient, org: str, name: str, privacy="closed", description="") -> str:
     body = {"name": name, "privacy": privacy, "description": description}
-    cp = run(["gh","api","--method","POST", f"orgs/{org}/teams",
-              "-H","Content-Type: application/json","--input","-"],
-             input_text=json.dumps(body))
-    if cp.returncode != 0:
-        print(f"✖ create team '{name}' failed:\n{cp.stderr or cp.stdout}"); sys.exit(1)
-    data = json.loads(cp.stdout) if cp.stdout.strip() else {}
-    return data["slug"]
-
-def team_membership(org: str, slug: str, username: str) -> str | None:
-    """Return 'member' or 'maintainer' if in team, otherwise None."""
-    cp = run(["gh","api", f"orgs/{org}/teams/{slug}/memberships/{username}", "--jq", ".role"])
-    if cp.returncode == 0 and cp.stdout.strip() in ("member","maintainer"):
-        return cp.stdout.strip()
-    return None
-
-def add_to_team(org: str, slug: str, username: str, role="member") -> bool:
+    r = await gh.post(f"/orgs/{org}/teams", body)
+    if not r.ok:
+        raise GhError(f"create team '{name}' failed ({r.status}): {r.text()}")
+    return (r.json() or {})["slug"]
+
+TEAMS_QUERY = """
+query($org: String!, $after: String) {
+  organization(login: $org) {
+    teams(first: 100, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        slug name
+        members(first: 100, membership: IMMEDIATE) {
+          pageInfo { hasNextPage endCursor }
+          edges { role node { login } }
+        }
+      }
+    }
+  }
+}"""
+
+TEAM_MEMBERS_QUERY = """
+query($org: String!, $slug: String!, $after: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      members(first: 100, after: $after, membership: IMMEDIATE) {
+        pageInfo { hasNextPage endCursor }
+        edges { role node { login } }
+      }
+    }
+  }
+}"""
+
+async def fetch_all_teams(gh: GhClient, org: str) -> dict[str, dict]:
+    """Return {slug: {"name", "members": {login_lower: 'member'|'maintainer'}}} for every team."""
+    teams, after = {}, None
+    while True:
+        conn = (await gh.graphql(TEAMS_QUERY, org=org, after=after))["organization"]["teams"]
+        for t in conn["nodes"]:
+            members, m_conn = {}, t["members"]
+            while True:
+                members.update((e["node"]["login"].lower(), e["role"].lower()) for e in m_conn["edges"])
+                if not m_conn["pageInfo"]["hasNextPage"]: break
+                m_conn = (await gh.graphql(TEAM_MEMBERS_QUERY, org=org, slug=t["slug"],
+                                           after=m_conn["pageInfo"]["endCursor"]))["organization"]["team"]["members"]
+            teams[t["slug"]] = {"name": t["name"], "members": members}
+        if not conn["pageInfo"]["hasNextPage"]: return teams
+        after = conn["pageInfo"]["endCursor"]
+
+async def add_to_team(gh: GhClient, org: str, slug: str, username: str, role="member", say=print) -> bool:
     body = {"role": role}  # "member" or "maintainer"
-    cp = run(["gh","api","--method","PUT", f"orgs/{org}/teams/{slug}/memberships/{username}",
-              "-H","Content-Type: application/json","--input","-"],
-             input_text=json.dumps(body))
-    if cp.returncode == 0:
+    try: r = await gh.put(f"/orgs/{org}/teams/{slug}/memberships/{quote(username)}", body)
+    except (HTTPException, OSError) as e:
+        say(f"  ! add_to_team {slug}:{username} failed: {e}"); return False
+    if r.ok:
         return True
     # Non-fatal: if user is not yet in org, GitHub will invite them automatically on team add
-    print(f"  ! add_to_team {slug}:{username} failed: {cp.stderr or cp.stdout}".strip())
+    say(f"  ! add_to_team {slug}:{username} failed: {r.text()}".strip())
     return False
 
 def load_students(path: Path):
     raw = path.read_text(encoding="utf-8")
     # tolerate trailing commas if present
-    cleaned = re.sub(r',\s*([}\]])', r'\1', raw)
+    cleaned = _TRAILING_COMMA.sub(r'\1', raw)
     data = json.loads(cleaned)
-    rows = []
+    # column layout: parallel lists, one entry per student; "keys" is the lowercased
+    # username that every lookup uses (GitHub logins are case-insensitive)
+    cols = {"names": [], "usernames": [], "keys": [], "groups": []}
     for it in data:
         if not isinstance(it, dict): continue
         u = (it.get("username") or "").strip().lstrip("@")
         g = (it.get("group") or "").strip()
         n = (it.get("name") or "").strip()
         if u and g:
-            rows.append({"name": n, "username": u, "group": g})
-    if not rows:
+            cols["names"].append(n); cols["usernames"].append(u); cols["keys"].append(u.lower()); cols["groups"].append(g)
+    if not cols["usernames"]:
         print("✖ No students with 'username' and 'group' found"); sys.exit(1)
-    return rows
+    return cols
 
 def main():
     ap = argparse.ArgumentParser(description="Create teams if missing and add members (students + instructors).")
@@ -72,62 +112,107 @@ def main():
     ap.add_argument("--instructors", required=True, help="comma-separated usernames to be in every team")
     ap.add_argument("--team-privacy", default="closed", choices=["closed","secret"])
     ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--sort", action="store_true", help="schedule (and number) teams by group name instead of file order")
     args = ap.parse_args()
 
-    gh_ok(args.org)
+    gh_ok()
     students = load_students(Path(args.file))
-
-    # build group -> members mapping
-    groups = {}
-    for s in students:
-        groups.setdefault(s["group"], []).append(s["username"])
-    instr = [u.strip().lstrip("@") for u in args.instructors.split(",") if u.strip()]
-
-    print(f"Found {len(groups)} groups; ensuring teams exist and memberships are set.")
-    for i, (group_name, members) in enumerate(sorted(groups.items()), 1):
-        team_name  = group_name        # display name
-        team_slug  = slugify(group_name)  # team slug
-        print(f"\n[{i}/{len(groups)}] Team '{team_name}' (slug: {team_slug})")
-
-        # Check/create team
-        if team_exists(args.org, team_slug):
-            print("  • team exists")
+    asyncio.run(sync_teams(args, students))
+
+async def process_team(gh: GhClient, args, header: str, team_slug: str, team_name: str, members: list[tuple[str, str]],
+                       instr: list[tuple[str, str]], org_members: frozenset[str], teams: dict[str, dict],
+                       sem: asyncio.Semaphore, put_sem: asyncio.Semaphore) -> str:
+    """Bring one team in line with the roster; returns the team's log block."""
+    out = io.StringIO()
+    def say(line: str): print(line, file=out)
+    say(f"\n{header} Team '{team_name}' (slug: {team_slug})")
+
+    async with sem:
+        # Check/create team; the roster comes from the preloaded teams
+        roster = {}
+        if team_slug in teams:
+            say("  • team exists")
+            roster = teams[team_slug]["members"]
         else:
             if args.dry_run:
-                print("  • DRY: would create team")
+                say("  • DRY: would create team")
             else:
-                created_slug = create_team(args.org, team_name, privacy=args.team_privacy)
-                print(f"  • created team (slug={created_slug})")
-
-        # Ensure instructors present as maintainers
-        for u in instr:
-            role_now = team_membership(args.org, team_slug, u)
+                try: created_slug = await create_team(gh, args.org, team_name, privacy=args.team_privacy)
+                except (GhError, HTTPException, OSError) as e:
+                    # report this team as failed and let the other teams finish
+                    say(f"  ✖ {e}")
+                    return out.getvalue()
+                say(f"  • created team (slug={created_slug})")
+                teams[team_slug] = teams[created_slug] = {"name": team_name, "members": roster}
+
+        # Work out every missing/promoted membership first, then send them together
+        adds = []  # (username, key, role, log label, dry-run label)
+        # one PUT per key: instructors are queued first so their maintainer role wins,
+        # and repeated / case-variant entries are reported instead of sent again
+        queued = {}  # key -> role already queued in `adds`
+        for u, key in instr:
+            if key in queued:
+                continue
+            role_now = roster.get(key)
             if role_now == "maintainer":
-                print(f"  • instructor {u}: already maintainer")
+                say(f"  • instructor {u}: already maintainer")
             elif role_now == "member":
-                if args.dry_run:
-                    print(f"  • DRY: would promote {u} to maintainer")
-                else:
-                    ok = add_to_team(args.org, team_slug, u, role="maintainer")
-                    print(f"  • instructor {u}: promote to maintainer -> {'ok' if ok else 'fail'}")
+                adds.append((u, key, "maintainer", f"instructor {u}: promote to maintainer", f"promote {u} to maintainer"))
+                queued[key] = "maintainer"
             else:
-                if args.dry_run:
-                    print(f"  • DRY: would add instructor {u} as maintainer")
-                else:
-                    ok = add_to_team(args.org, team_slug, u, role="maintainer")
-                    print(f"  • instructor {u}: add maintainer -> {'ok' if ok else 'fail'}")
-
-        # Ensure students present as members
-        for u in members:
-            role_now = team_membership(args.org, team_slug, u)
+                adds.append((u, key, "maintainer", f"instructor {u}: add maintainer", f"add instructor {u} as maintainer"))
+                queued[key] = "maintainer"
+
+        for u, key in members:
+            # outside the org means outside the team; the team add doubles as the org invite
+            in_org = key in org_members
+            role_now = roster.get(key) if in_org else None
+            note = "" if in_org else " (invites to org)"
             if role_now in ("member","maintainer"):
-                print(f"  • {u}: already in team ({role_now})")
+                say(f"  • {u}: already in team ({role_now})")
+            elif key in queued:
+                say(f"  • {u}: already queued ({queued[key]})")
             else:
-                if args.dry_run:
-                    print(f"  • DRY: would add {u} as member")
-                else:
-                    ok = add_to_team(args.org, team_slug, u, role="member")
-                    print(f"  • {u}: add member -> {'ok' if ok else 'fail'}")
+                adds.append((u, key, "member", f"{u}: add member{note}", f"add {u} as member{note}"))
+                queued[key] = "member"
+
+        if args.dry_run:
+            for *_, dry in adds: say(f"  • DRY: would {dry}")
+        else:
+            async def add(u: str, role: str) -> bool:
+                async with put_sem:
+                    return await add_to_team(gh, args.org, team_slug, u, role=role, say=say)
+            results = await asyncio.gather(*(add(u, role) for u, _, role, _, _ in adds))
+            for (_, key, role, label, _), ok in zip(adds, results):
+                if ok: roster[key] = role
+                say(f"  • {label} -> {'ok' if ok else 'fail'}")
+
+    return out.getvalue()
+
+async def sync_teams(args, students):
+    # build slug -> (display name, members); groups whose names slugify alike share one team
+    groups: dict[str, tuple[str, list[tuple[str, str]]]] = {}
+    for g, u, key in zip(students["groups"], students["usernames"], students["keys"]):
+        groups.setdefault(slugify(g), (g, []))[1].append((u, key))
+    instr = [(u, u.lower()) for u in (u.strip().lstrip("@") for u in args.instructors.split(",")) if u]
+    # teams and membership PUTs are capped separately so nested waits cannot starve each other
+    sem, put_sem = asyncio.Semaphore(8), asyncio.Semaphore(8)
+
+    async with GhClient() as gh:
+        await org_ok(gh, args.org)
+        try: org_members = await fetch_org_members(gh, args.org)
+        except GhError as e: print(f"✖ cannot list org members: {e}"); sys.exit(1)
+        try: teams = await fetch_all_teams(gh, args.org)
+        except GhError as e: print(f"✖ cannot list teams: {e}"); sys.exit(1)
+
+        print(f"Found {len(groups)} groups; ensuring teams exist and memberships are set.")
+        # teams run concurrently; each team's buffered log is printed as soon as it finishes
+        items = sorted(groups.items()) if args.sort else groups.items()
+        for done in asyncio.as_completed([
+            process_team(gh, args, f"[{i}/{len(groups)}]", slug, name, members, instr, org_members, teams, sem, put_sem)
+            for i, (slug, (name, members)) in enumerate(items, 1)
+        ]):
+            print(await done, end="")
 
     print("\nDone.")
 